@@ -1,14 +1,20 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from typing import Optional
 import PyPDF2
-import io
+import pypdfium2 as pdfium
+import asyncio
 import faiss
 import numpy as np
-import requests
+import httpx
 import os
 import logging
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
 
 # Configure logging
 logging.basicConfig(
@@ -20,12 +26,14 @@ logger = logging.getLogger(__name__)
 # Load API key from environment
 API_KEY = os.getenv("OPENROUTER_API_KEY")
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*")
+QUANTIZE_EMBEDDER = os.getenv("QUANTIZE_EMBEDDER", "true").lower() in ("1", "true", "yes")
+ENABLE_GPU_FAISS = os.getenv("ENABLE_GPU_FAISS", "false").lower() in ("1", "true", "yes")
 
 if not API_KEY:
     logger.warning("OPENROUTER_API_KEY not set - API calls will fail")
 
 # Initialize FastAPI
-app = FastAPI(title="RAG PDF System-v2")
+app = FastAPI(title="RAG PDF System-v2", default_response_class=ORJSONResponse)
 
 # CORS Configuration
 allowed_origins = ALLOWED_ORIGINS.split(",") if ALLOWED_ORIGINS != "*" else ["*"]
@@ -37,82 +45,502 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global model variable - LAZY LOADED
+# Shared HTTP client - pooled keep-alive connections over HTTP/2 to OpenRouter
+http_client = httpx.AsyncClient(
+    timeout=30.0,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+)
+
+# Global model variable - loaded and warmed up at startup
 embedder = None
+embedder_variant = None  # e.g. "cuda-fp16", "cpu-int8" - part of embedding cache keys
+embedder_ready = False
+embedder_lock = threading.Lock()
+# Fast tokenizers mutate their truncation/padding state per call, so callers with
+# different settings each get their own copy instead of sharing model.tokenizer
+query_tokenizer = None
+chunk_tokenizer = None
+MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBED_BATCH_SIZE = 64
+# Chunks stay under the model's 256-token limit so nothing is truncated
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 20
 
 def get_embedder():
-    """Lazy load the sentence transformer model on first use"""
-    global embedder
-    if embedder is None:
-        logger.info("Loading sentence transformer model (first time)...")
-        from sentence_transformers import SentenceTransformer
-        embedder = SentenceTransformer('all-MiniLM-L6-v2')
-        logger.info("Model loaded successfully!")
+    """Return the sentence transformer model, loading it once if needed"""
+    global embedder, embedder_variant, query_tokenizer, chunk_tokenizer
+    if embedder is not None:
+        return embedder
+    with embedder_lock:
+        if embedder is None:
+            logger.info("Loading sentence transformer model...")
+            import torch
+            from sentence_transformers import SentenceTransformer
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            model = SentenceTransformer(MODEL_NAME, device=device)
+            if device == "cuda":
+                model.half()  # fp16 on GPU
+                variant = "cuda-fp16"
+            else:
+                torch.set_num_threads(os.cpu_count() or 1)
+                if QUANTIZE_EMBEDDER:
+                    # int8 Linear layers run on fbgemm's AVX2/AVX-512 VNNI kernels
+                    model = torch.quantization.quantize_dynamic(
+                        model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                    variant = "cpu-int8"
+                else:
+                    variant = "cpu-fp32"
+            query_tokenizer = copy.deepcopy(model.tokenizer)
+            chunk_tokenizer = copy.deepcopy(model.tokenizer)
+            # Publish the model last; other threads skip the lock once it is set
+            embedder = model
+            embedder_variant = variant
+            with query_embedding_cache_lock:
+                query_embedding_cache.clear()  # Cached vectors belong to the old model
+            logger.info(f"Model loaded successfully ({variant})!")
     return embedder
 
-# PDF storage
-pdf_store = {
-    "chunks": [],
-    "embeddings": None,
-    "index": None
-}
+
+def warmup_embedder():
+    """Load the model and run one encode to initialize tokenizer and kernels"""
+    global embedder_ready
+    try:
+        get_embedder().encode(["warmup"], batch_size=1, show_progress_bar=False)
+        embedder_ready = True
+        logger.info("Model warmed up and ready")
+    except Exception as e:
+        logger.error(f"Model warmup failed: {str(e)}")
+
+
+async def warmup_with_retry(max_delay=300):
+    """Retry warmup with exponential backoff until the model is ready"""
+    delay = 5
+    while True:
+        await asyncio.to_thread(warmup_embedder)
+        if embedder_ready:
+            return
+        logger.info(f"Retrying model warmup in {delay}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+# Below this many chunks a brute-force scan beats building an HNSW graph
+HNSW_MIN_CHUNKS = 500
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 32
+
+# GPU resources for FAISS - only when enabled and a faiss-gpu build sees a GPU
+gpu_resources = None
+# StandardGpuResources is not thread-safe; uploads and the search batcher use
+# it from different worker threads, so every GPU call holds this lock
+gpu_lock = threading.Lock()
+if ENABLE_GPU_FAISS:
+    if hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0:
+        gpu_resources = faiss.StandardGpuResources()
+        logger.info("FAISS GPU search enabled")
+    else:
+        logger.warning("ENABLE_GPU_FAISS set but no FAISS GPU support found - using CPU")
+
+# On-disk chunk embedding cache - one .npy per SHA-256(model version + chunk text)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./emb_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+EMBEDDING_CACHE_VERSION = f"{MODEL_NAME}:v1"  # Bump to invalidate on model changes
+embedding_cache_lock = threading.Lock()
+
+
+def embedding_cache_path(key):
+    """Path of the cache file for one chunk embedding"""
+    return os.path.join(EMBEDDING_CACHE_DIR, f"{key}.npy")
+
+
+def load_cached_embedding(key):
+    """Return a cached chunk embedding, or None on a miss"""
+    path = embedding_cache_path(key)
+    try:
+        embedding = np.load(path)
+        os.utime(path)  # Mark as recently used for eviction
+        return embedding
+    except (OSError, ValueError):
+        return None
+
+
+def save_cached_embeddings(entries):
+    """Write new (key, embedding) entries, then evict least recently used files"""
+    with embedding_cache_lock:
+        try:
+            os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+            for key, embedding in entries:
+                path = embedding_cache_path(key)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, embedding)
+                os.replace(tmp_path, path)
+
+            with os.scandir(EMBEDDING_CACHE_DIR) as it:
+                files = [(entry.stat().st_mtime, entry.path) for entry in it
+                         if entry.name.endswith(".npy")]
+            if len(files) > EMBEDDING_CACHE_MAX_ENTRIES:
+                files.sort()
+                for _, path in files[:len(files) - EMBEDDING_CACHE_MAX_ENTRIES]:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            logger.warning(f"Could not persist embedding cache: {str(e)}")
+
+
+# PDF storage - doc_id (SHA-256 of the PDF bytes) -> chunks, index
+# Bounded LRU - the least recently used PDF is evicted beyond MAX_DOCUMENTS
+MAX_DOCUMENTS = int(os.getenv("MAX_DOCUMENTS", "20"))
+pdf_store = OrderedDict()
+pdf_store_lock = threading.Lock()  # Searches snapshot the store from worker threads
+
+
+def get_document(doc_id):
+    """Return a stored document and mark it recently used, or None"""
+    with pdf_store_lock:
+        doc = pdf_store.get(doc_id)
+        if doc is not None:
+            pdf_store.move_to_end(doc_id)
+        return doc
+
+
+def add_document(doc_id, doc):
+    """Store a document and return the ids evicted to stay within MAX_DOCUMENTS"""
+    with pdf_store_lock:
+        pdf_store[doc_id] = doc
+        pdf_store.move_to_end(doc_id)
+        evicted = []
+        while len(pdf_store) > MAX_DOCUMENTS:
+            evicted.append(pdf_store.popitem(last=False)[0])
+    return evicted
 
 
 class Question(BaseModel):
     question: str
+    doc_id: Optional[str] = None  # Search all uploaded PDFs when omitted
+
+
+# PDFium is not thread-safe, even across documents; uploads parse in worker threads
+pdfium_lock = threading.Lock()
 
 
 def extract_text_from_pdf(pdf_file):
-    """Extract text from PDF file"""
+    """Extract text from PDF file with PDFium, falling back to PyPDF2"""
+    try:
+        with pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_file)
+            try:
+                parts = []
+                for page in pdf:
+                    textpage = page.get_textpage()
+                    parts.append(textpage.get_text_range())
+                    textpage.close()
+                    page.close()
+            finally:
+                pdf.close()
+        return "".join(parts)
+    except Exception as e:
+        logger.warning(f"PDFium extraction failed, falling back to PyPDF2: {str(e)}")
+
+    pdf_file.seek(0)
     pdf_reader = PyPDF2.PdfReader(pdf_file)
-    text = ""
-    for page in pdf_reader.pages:
-        text += page.extract_text() or ""
-    return text
+    return "".join(page.extract_text() or "" for page in pdf_reader.pages)
+
+
+def hash_pdf_file(pdf_file, block_size=1 << 20):
+    """SHA-256 of a seekable file, read in blocks and rewound for parsing"""
+    digest = hashlib.sha256()
+    pdf_file.seek(0)
+    for block in iter(lambda: pdf_file.read(block_size), b""):
+        digest.update(block)
+    pdf_file.seek(0)
+    return digest.hexdigest()
 
 
-def split_text(text, chunk_size=500):
-    """Split text into chunks"""
-    words = text.split()
+def split_text(text, chunk_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split text into overlapping windows of at most chunk_tokens model tokens"""
+    get_embedder()  # Chunk with a copy of the tokenizer the model uses
+    encoded = chunk_tokenizer(
+        text, return_offsets_mapping=True, add_special_tokens=False, verbose=False
+    )
+    offsets = encoded["offset_mapping"]
+
     chunks = []
-    for i in range(0, len(words), chunk_size):
-        chunk = " ".join(words[i:i + chunk_size])
-        chunks.append(chunk)
+    stride = chunk_tokens - overlap_tokens
+    for start in range(0, len(offsets), stride):
+        end = min(start + chunk_tokens, len(offsets))
+        # Slice the original text so whitespace and punctuation are preserved
+        chunks.append(text[offsets[start][0]:offsets[end - 1][1]])
+        if end == len(offsets):
+            break
     return chunks
 
 
-def create_embeddings(chunks):
-    """Create embeddings for text chunks"""
+def encode_chunks(chunks):
+    """Encode text chunks into L2-normalized embeddings"""
     model = get_embedder()  # Load model only when needed
-    embeddings = model.encode(chunks)
-    return np.array(embeddings).astype('float32')
+
+    # Chunks are near-uniform token windows and encode() already sorts them by
+    # length before batching, so one call keeps padding minimal
+    embeddings = model.encode(
+        chunks,
+        batch_size=EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,  # Inner product == cosine similarity
+        show_progress_bar=False,
+    )
+    return embeddings.astype('float32', copy=False)
+
+
+def create_embeddings(chunks):
+    """Create embeddings for text chunks, reusing cached ones from disk"""
+    get_embedder()  # Resolve the model variant before building cache keys
+    prefix = f"{EMBEDDING_CACHE_VERSION}:{embedder_variant}"
+    keys = [
+        hashlib.sha256(f"{prefix}\0{chunk}".encode()).hexdigest()
+        for chunk in chunks
+    ]
+
+    embeddings = [load_cached_embedding(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    logger.info(f"Embedding cache: {len(chunks) - len(missing)} hits, {len(missing)} misses")
+
+    if missing:
+        # Encode all misses in one batched call, outside the cache lock
+        new_embeddings = encode_chunks([chunks[i] for i in missing])
+        for i, embedding in zip(missing, new_embeddings):
+            embeddings[i] = embedding
+        save_cached_embeddings([(keys[i], embeddings[i]) for i in missing])
+
+    return np.stack(embeddings).astype('float32', copy=False)
 
 
 def create_faiss_index(embeddings):
-    """Create FAISS index for vector search"""
+    """Create FAISS inner-product index over normalized embeddings"""
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
+    if gpu_resources is not None:
+        # Brute-force GEMM search on GPU beats HNSW, which has no GPU version
+        index = faiss.IndexFlatIP(dimension)
+        index.add(embeddings)
+        with gpu_lock:
+            return faiss.index_cpu_to_gpu(gpu_resources, 0, index)
+
+    # 8-bit scalar quantization cuts the bytes scanned per query by 4x
+    if len(embeddings) < HNSW_MIN_CHUNKS:
+        index = faiss.IndexScalarQuantizer(
+            dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+    else:
+        # Graph-based index keeps search sub-linear for large documents
+        index = faiss.IndexHNSWSQ(
+            dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)
     index.add(embeddings)
+    if len(embeddings) >= HNSW_MIN_CHUNKS:
+        index.hnsw.efSearch = HNSW_EF_SEARCH
     return index
 
 
-def search_similar(query, top_k=3):
-    """Search for similar chunks in the PDF"""
-    if pdf_store["index"] is None:
-        return []
+QUERY_MAX_TOKENS = 128  # Queries are short; caps attention cost at 128x128
 
-    model = get_embedder()  # Load model only when needed
-    query_embedding = np.array(model.encode([query])).astype('float32')
-    _, indices = pdf_store["index"].search(query_embedding, top_k)
 
+def encode_queries(queries):
+    """Encode queries with the fast tokenizer and a single transformer forward pass"""
+    import torch
+    model = get_embedder()  # Load model only when needed
+    transformer = model._first_module().auto_model
+    encoded = query_tokenizer(
+        queries,
+        return_tensors="pt",
+        truncation=True,
+        max_length=QUERY_MAX_TOKENS,
+        padding=True,
+    ).to(model.device)
+
+    with torch.inference_mode():
+        token_embeddings = transformer(**encoded)[0].float()
+        # Mean pooling over real tokens, then L2 normalize (as all-MiniLM-L6-v2 does)
+        mask = encoded["attention_mask"].unsqueeze(-1).float()
+        pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+    return np.ascontiguousarray(pooled.cpu().numpy(), dtype=np.float32)
+
+
+# Query embedding LRU - query string -> (dim,) embedding, shared by all search paths
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+query_embedding_cache = OrderedDict()
+query_embedding_cache_lock = threading.Lock()
+
+
+def encode_queries_cached(queries):
+    """Return (n, dim) embeddings for distinct queries, batch-encoding only cache misses"""
+    found = {}
+    with query_embedding_cache_lock:
+        for query in queries:
+            if query in query_embedding_cache:
+                query_embedding_cache.move_to_end(query)
+                found[query] = query_embedding_cache[query]
+
+    missing = [query for query in queries if query not in found]
+    if missing:
+        new_embeddings = encode_queries(missing)
+        with query_embedding_cache_lock:
+            for query, embedding in zip(missing, new_embeddings):
+                found[query] = query_embedding_cache[query] = embedding.copy()
+                if len(query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                    query_embedding_cache.popitem(last=False)
+
+    # np.stack copies, so callers never mutate cached vectors
+    return np.stack([found[query] for query in queries])
+
+
+def select_docs(doc_id=None):
+    """Return the stored document for doc_id, or all documents when None"""
+    with pdf_store_lock:
+        if doc_id is not None:
+            return [pdf_store[doc_id]] if doc_id in pdf_store else []
+        return list(pdf_store.values())
+
+
+def search_index(index, query_embeddings, top_k):
+    """Search one FAISS index, serializing searches that share the GPU resources"""
+    if gpu_resources is None:
+        return index.search(query_embeddings, top_k)
+    with gpu_lock:
+        return index.search(query_embeddings, top_k)
+
+
+def search_similar_batch(query_embeddings, top_k=3, doc_id=None):
+    """Search a (n, dim) batch of query embeddings with one FAISS call per document"""
+    scored = [[] for _ in range(len(query_embeddings))]
+    for doc in select_docs(doc_id):
+        scores, indices = search_index(doc["index"], query_embeddings, top_k)
+        for row, (row_scores, row_indices) in enumerate(zip(scores, indices)):
+            for score, idx in zip(row_scores, row_indices):
+                # FAISS pads with -1 when fewer than top_k neighbours are found
+                if 0 <= idx < len(doc["chunks"]):
+                    scored[row].append((score, doc["chunks"][idx]))
+
+    # Merge per-document hits by cosine similarity
     results = []
-    for idx in indices[0]:
-        if idx < len(pdf_store["chunks"]):
-            results.append(pdf_store["chunks"][idx])
+    for hits in scored:
+        hits.sort(key=lambda item: item[0], reverse=True)
+        results.append([chunk for _, chunk in hits[:top_k]])
     return results
 
 
-def ask_llm(question, context):
+def search_similar(query, top_k=3, doc_id=None):
+    """Search for similar chunks in one PDF, or across all uploaded PDFs"""
+    if not select_docs(doc_id):
+        return []
+    query_embeddings = encode_queries_cached([query])
+    return search_similar_batch(query_embeddings, top_k=top_k, doc_id=doc_id)[0]
+
+
+def run_search_batch(searches):
+    """Run (query, top_k, doc_id) searches with a single transformer forward pass"""
+    queries = list(dict.fromkeys(query for query, _, _ in searches))
+    query_rows = {query: row for row, query in enumerate(queries)}
+    query_embeddings = encode_queries_cached(queries)
+
+    # One FAISS call per distinct (top_k, doc_id) combination
+    groups = {}
+    for i, (_, top_k, doc_id) in enumerate(searches):
+        groups.setdefault((top_k, doc_id), []).append(i)
+
+    results = [None] * len(searches)
+    for (top_k, doc_id), members in groups.items():
+        rows = query_embeddings[[query_rows[searches[i][0]] for i in members]]
+        for i, chunks in zip(members, search_similar_batch(rows, top_k=top_k, doc_id=doc_id)):
+            results[i] = chunks
+    return results
+
+
+# Micro-batcher - concurrent /ask/ searches are collected for a few ms and run together
+BATCH_WINDOW_SECONDS = 0.008
+MAX_SEARCH_BATCH = 32
+search_queue = None  # asyncio.Queue of (query, top_k, doc_id, future), created at startup
+
+
+async def search_batch_worker():
+    """Drain the search queue in batches and resolve each caller's future"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await search_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW_SECONDS
+        while len(batch) < MAX_SEARCH_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(search_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        searches = [(query, top_k, doc_id) for query, top_k, doc_id, _ in batch]
+        try:
+            results = await asyncio.to_thread(run_search_batch, searches)
+        except Exception as e:
+            logger.error(f"Batched search failed: {str(e)}")
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        logger.debug(f"Ran batched search for {len(batch)} queries")
+        for (*_, future), chunks in zip(batch, results):
+            if not future.done():
+                future.set_result(chunks)
+
+
+async def batched_search(query, top_k=3, doc_id=None):
+    """Queue a search for the micro-batcher and wait for its result"""
+    if search_queue is None:
+        # Batcher not started (startup hook skipped) - search directly
+        return await asyncio.to_thread(search_similar, query, top_k, doc_id)
+    future = asyncio.get_running_loop().create_future()
+    await search_queue.put((query, top_k, doc_id, future))
+    return await future
+
+
+# Exact-match search cache - (query, top_k, doc_id) -> chunks
+SEARCH_CACHE_SIZE = 256
+search_cache = OrderedDict()
+search_cache_generation = 0
+
+
+def invalidate_search_cache(doc_id):
+    """Drop results for doc_id and all-document results that may have changed with it"""
+    global search_cache_generation
+    for key in [key for key in search_cache if key[2] is None or key[2] == doc_id]:
+        del search_cache[key]
+    # In-flight searches will not repopulate stale entries
+    search_cache_generation += 1
+
+
+async def cached_search(query, top_k=3, doc_id=None):
+    """Serve repeated searches from the LRU cache, batching the misses"""
+    key = (query, top_k, doc_id)
+    if key in search_cache:
+        search_cache.move_to_end(key)
+        return search_cache[key]
+
+    generation = search_cache_generation
+    results = tuple(await batched_search(query, top_k, doc_id))
+    if generation == search_cache_generation:
+        search_cache[key] = results
+        if len(search_cache) > SEARCH_CACHE_SIZE:
+            search_cache.popitem(last=False)
+    return results
+
+
+async def ask_llm(question, context):
     """Ask LLM with context"""
     if not API_KEY:
         return "Error: OPENROUTER_API_KEY not configured"
@@ -141,11 +569,11 @@ Answer:"""
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        response = await http_client.post(url, headers=headers, json=data)
         response.raise_for_status()
         result = response.json()
         return result["choices"][0]["message"]["content"]
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Error connecting to OpenRouter: {str(e)}")
         return f"Error connecting to model: {str(e)}"
     except KeyError as e:
@@ -156,13 +584,40 @@ Answer:"""
         return f"Unexpected error: {str(e)}"
 
 
+@app.on_event("startup")
+async def start_warmup():
+    """Warm up the model in the background so /health can report readiness"""
+    app.state.warmup_task = asyncio.create_task(warmup_with_retry())
+
+
+@app.on_event("startup")
+async def start_search_batcher():
+    """Start the background task that batches concurrent searches"""
+    global search_queue
+    search_queue = asyncio.Queue()
+    app.state.search_batcher_task = asyncio.create_task(search_batch_worker())
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    """Stop the search batcher and any pending warmup retries"""
+    app.state.search_batcher_task.cancel()
+    app.state.warmup_task.cancel()
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    """Close pooled connections on shutdown"""
+    await http_client.aclose()
+
+
 @app.get("/")
 async def root():
     """API information"""
     return {
         "message": "RAG System for PDF Processing",
         "version": "2.0.0",
-        "pdf_loaded": pdf_store["index"] is not None,
+        "pdf_loaded": bool(pdf_store),
         "model_loaded": embedder is not None,
         "endpoints": {
             "/upload-pdf/": "POST - Upload PDF file",
@@ -175,50 +630,80 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Health check endpoint - returns 503 until the model is warmed up"""
+    if not embedder_ready:
+        return ORJSONResponse(status_code=503, content={
+            "status": "loading",
+            "model_loaded": embedder is not None,
+        })
     return {
         "status": "healthy",
         "model_loaded": embedder is not None,
-        "pdf_loaded": pdf_store["index"] is not None,
-        "chunks_count": len(pdf_store["chunks"]) if pdf_store["chunks"] else 0,
+        "pdf_loaded": bool(pdf_store),
+        "documents_count": len(pdf_store),
+        "chunks_count": sum(len(doc["chunks"]) for doc in select_docs()),
         "api_key_configured": API_KEY is not None
     }
 
 
 @app.post("/upload-pdf/")
 async def upload_pdf(file: UploadFile = File(...)):
-    """Upload and process PDF file - Model loads on first use"""
+    """Upload and process PDF file"""
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be PDF")
 
     try:
         logger.info(f"Processing PDF: {file.filename}")
-        contents = await file.read()
-        pdf_file = io.BytesIO(contents)
-
-        text = extract_text_from_pdf(pdf_file)
+        # Parse straight from the spooled upload instead of copying it into memory
+        pdf_file = file.file
+        doc_id = await asyncio.to_thread(hash_pdf_file, pdf_file)
+
+        doc = get_document(doc_id)
+        if doc is not None:
+            logger.info("PDF already processed - reusing stored index")
+            return {
+                "message": "File already processed",
+                "filename": file.filename,
+                "doc_id": doc_id,
+                "num_chunks": len(doc["chunks"]),
+                "total_characters": doc["total_characters"]
+            }
+
+        # Run blocking parse/encode work off the event loop
+        text = await asyncio.to_thread(extract_text_from_pdf, pdf_file)
         if not text.strip():
             raise HTTPException(status_code=400, detail="No text found in PDF")
 
-        chunks = split_text(text)
+        chunks = await asyncio.to_thread(split_text, text)
+        if not chunks:
+            # e.g. only control/format characters that the tokenizer drops
+            raise HTTPException(status_code=400, detail="No text found in PDF")
         logger.info(f"Created {len(chunks)} chunks")
 
-        # This will trigger model download on first call
-        embeddings = create_embeddings(chunks)
-        index = create_faiss_index(embeddings)
+        embeddings = await asyncio.to_thread(create_embeddings, chunks)
+        index = await asyncio.to_thread(create_faiss_index, embeddings)
 
-        pdf_store["chunks"] = chunks
-        pdf_store["embeddings"] = embeddings
-        pdf_store["index"] = index
+        # Publish the document in one step so searches never see it half-built
+        evicted = add_document(doc_id, {
+            "filename": file.filename,
+            "chunks": chunks,
+            "index": index,
+            "total_characters": len(text)
+        })
+        invalidate_search_cache(doc_id)  # Cross-document results may have changed
+        for evicted_id in evicted:
+            logger.info(f"Evicted least recently used PDF {evicted_id}")
+            invalidate_search_cache(evicted_id)
 
         logger.info("PDF processed successfully")
 
-        return JSONResponse({
+        return {
             "message": "File uploaded and processed successfully",
             "filename": file.filename,
+            "doc_id": doc_id,
             "num_chunks": len(chunks),
             "total_characters": len(text)
-        })
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -229,24 +714,26 @@ async def upload_pdf(file: UploadFile = File(...)):
 @app.post("/ask/")
 async def ask_question(question: Question):
     """Ask a question about uploaded PDF"""
-    if pdf_store["index"] is None:
+    if not pdf_store:
         raise HTTPException(status_code=400, detail="Must upload PDF first")
+    if question.doc_id is not None and get_document(question.doc_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown doc_id")
 
     try:
         logger.info(f"Received question: {question.question}")
 
-        relevant_chunks = search_similar(question.question, top_k=3)
+        relevant_chunks = await cached_search(question.question, top_k=3, doc_id=question.doc_id)
         if not relevant_chunks:
             raise HTTPException(status_code=404, detail="No relevant information found")
 
         context = "\n\n".join(relevant_chunks)
-        answer = ask_llm(question.question, context)
+        answer = await ask_llm(question.question, context)
 
-        return JSONResponse({
+        return {
             "question": question.question,
             "answer": answer,
             "sources_used": len(relevant_chunks)
-        })
+        }
     except HTTPException:
         raise
     except Exception as e: